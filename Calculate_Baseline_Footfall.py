@@ -1,9 +1,16 @@
 import requests
-import time
+import json
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 import os
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin, quote
-from bs4 import BeautifulSoup
+from lxml import etree
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 
 # import matplotlib.pyplot as plt
 import re
@@ -18,11 +25,64 @@ TARGET_S3_PREFIX = "Network Demand/"
 # The specific folder path within the S3 bucket to list.
 TARGET_FILENAME_PREFIX = "StationFootfall"
 
+# XML namespace used by the S3 ListObjectsV2 response.
+S3_XML_NAMESPACE = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+
 # Local folder to save the downloaded CSV files.
 DOWNLOAD_FOLDER = "NetworkDemand/"
 
+# Sidecar file (in the download folder) storing the ETag of each downloaded CSV file.
+ETAGS_FILENAME = "etags.json"
+
+# Chunk size used when streaming downloads to disk (1 MiB).
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Maximum number of files downloaded concurrently (keeps the load on the server polite).
+MAX_DOWNLOAD_WORKERS = 8
+
+# Shared HTTP session: pooled keep-alive connections and automatic retries on
+# transient errors, reused by every request made by this script.
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]
+        ),
+    ),
+)
+
+# Column names and Arrow types used when parsing the footfall CSV files.
+FOOTFALL_CSV_HEADERS = ["date", "weekday", "station", "entries", "exits"]
+FOOTFALL_CSV_COLUMN_TYPES = {
+    "date": pa.int32(),  # 8-digit YYYYMMDD integers
+    "weekday": pa.string(),
+    "station": pa.string(),
+    "entries": pa.int32(),
+    "exits": pa.int32(),
+}
+
+# Footfall station names that differ from the station info (API) names.
+STATION_NAME_RENAMES = {
+    "Edgware Road B": "Edgware Road (Bakerloo)",
+    "Edgware Road C&H": "Edgware Road (Circle Line)",
+    "Heathrow Terminals 2&3": "Heathrow Terminals 2 & 3",
+    "Hammersmith C&H": "Hammersmith (H&C Line)",
+    "Hammersmith D&P": "Hammersmith (Dist&Picc Line)",
+    "Shepherds Bush": "Shepherd's Bush (Central)",
+    "Watford Met": "Watford",
+}
+
+# Precompiled patterns used to standardize station names for merging.
+NON_ALPHANUMERIC_PATTERN = re.compile(r"[^a-z0-9\s]")
+MULTIPLE_WHITESPACE_PATTERN = re.compile(r"\s+")
+
 FILE_PATH_STATION_INFO = "data/station_info.xlsx"
 FILE_PATH_FOOTFALL_BASELINE = "data/stations_baseline_footfall.xlsx"
+# Parquet copy of the baseline, read by Get_Live_Crowding (much faster to load than Excel).
+FILE_PATH_FOOTFALL_BASELINE_PARQUET = "data/stations_baseline_footfall.parquet"
 
 
 def list_s3_bucket_files(base_url, s3_prefix):
@@ -33,68 +93,108 @@ def list_s3_bucket_files(base_url, s3_prefix):
     # quote() is used to URL-encode the prefix (ee.g., spaces to %20).
     s3_list_url = f"{base_url}?list-type=2&max-keys=1000&prefix={quote(s3_prefix)}"
 
-    response = requests.get(s3_list_url)
-    response.raise_for_status()  # Raises HTTPError for bad responses.
-
-    soup = BeautifulSoup(response.text, "xml")  # Parses the XML response.
+    with SESSION.get(s3_list_url, stream=True) as response:
+        response.raise_for_status()  # Raises HTTPError for bad responses.
+        response.raw.decode_content = True  # Decompresses gzip/deflate on the fly.
 
-    file_keys = []
-    # Extracts file keys from <Contents> tags in the XML.
-    for content_tag in soup.find_all("Contents"):
-        key = content_tag.find("Key").text
-        # Excludes folder markers and the index.html file.
-        if key.endswith("/") or key == "index.html":
-            continue
-        file_keys.append(key)
+        file_keys = []
+        # Streams the XML response, extracting file keys from <Contents> tags as they arrive.
+        for _, content_tag in etree.iterparse(
+            response.raw, tag=f"{S3_XML_NAMESPACE}Contents"
+        ):
+            key = content_tag.findtext(f"{S3_XML_NAMESPACE}Key")
+            content_tag.clear()  # Frees the parsed element to keep memory flat.
+            # Excludes folder markers and the index.html file.
+            if key.endswith("/") or key == "index.html":
+                continue
+            file_keys.append(key)
 
     return file_keys
 
 
-def download_file(url, local_filename=None):
+def download_file(url, local_filename=None, session=None, etags=None):
     """
     Downloads a single file from a URL to a local path.
     Handles basic HTTP and file I/O errors.
+    Uses the shared pooled SESSION unless another requests.Session is passed in.
+    If an etags dict (filename -> ETag) is passed, an existing file is only downloaded
+    again if it changed on the server, and the dict is updated with the new ETag.
+    Returns None if the server reports the file as not modified.
     """
+    session_to_use = session if session else SESSION
+
+    filename = os.path.basename(local_filename)
+    headers = {}
+    if etags and etags.get(filename) and os.path.exists(local_filename):
+        headers["If-None-Match"] = etags[filename]  # Conditional GET
+
+    with session_to_use.get(url, stream=True, headers=headers) as r:
+        if r.status_code == 304:
+            print(f"File '{local_filename}' is unchanged. Skipping download.")
+            return None
 
-    with requests.get(url, stream=True) as r:
         r.raise_for_status()  # Checks for HTTP errors (e.g., 404).
 
         with open(local_filename, "wb") as f:
-            # Writes content in 8KB chunks.
-            for chunk in r.iter_content(chunk_size=8192):
+            # Writes content in 1MB chunks.
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
                 f.write(chunk)
+
+        if etags is not None and r.headers.get("ETag"):
+            etags[filename] = r.headers["ETag"]
     print(f"File '{local_filename}' downloaded successfully.")
     return local_filename
 
 
+def remove_cached_parquet(csv_path):
+    """
+    Deletes the cached Parquet copy of a footfall CSV file (written by load_footfall_table),
+    so a removed or replaced CSV doesn't leave a stale copy behind.
+    """
+    parquet_path = os.path.splitext(csv_path)[0] + ".parquet"
+    if os.path.exists(parquet_path):
+        os.remove(parquet_path)
+
+
 def get_network_demand_files(base_url, s3_prefix, filename_prefix, save_folder):
 
     # Creates parent directories if they don't exist.
     os.makedirs(os.path.dirname(save_folder) or ".", exist_ok=True)
 
-    # Delete the last file that contains last years and current years data.
-    # When a new year starts, this file is replaced by two separate files.
+    # Only the CSV files are considered; the folder also holds their cached Parquet copies.
+    # A set gives O(1) membership checks against the S3 keys below.
+    files = {
+        entry.name for entry in os.scandir(save_folder) if entry.name.endswith(".csv")
+    }
+
+    # The last file contains last years and current years data, so it is always refreshed.
+    # When a new year starts, this file is replaced by two separate files (and deleted below).
     # E.g. StationFootfall_2024_2025.csv -> StationFootfall_2024.csv and StationFootfall_2025.csv.
+    last_file = max(files, default=None)  # No need to sort just to find the last file
+    files.discard(last_file)
 
-    files = sorted(os.listdir(save_folder))
-    print(f"Deleting the last file in '{save_folder}' ({files[-1]})...")
-    os.remove(os.path.join(save_folder, files[-1]))
+    # Load the ETags of previously downloaded files, so unchanged files can be skipped.
+    etags_path = os.path.join(save_folder, ETAGS_FILENAME)
+    etags = {}
+    if os.path.exists(etags_path):
+        with open(etags_path) as f:
+            etags = json.load(f)
 
     print(f"Getting files in S3 prefix: {s3_prefix}")
 
     # Get all file keys within the target S3 prefix.
     all_s3_keys = list_s3_bucket_files(base_url, s3_prefix)
 
-    downloaded_count = 0
-
     # Filter for files matching the "StationFootfall_XX.csv" pattern.
+    listed_filenames = set()
+    download_jobs = []
     for s3_key in all_s3_keys:
         filename = s3_key.split("/")[-1]  # Extract just the filename from the S3 key.
-        if (
-            filename.startswith(filename_prefix)
-            and filename.endswith(".csv")
-            and (filename not in files[:-1])
-        ):
+        if filename.startswith(filename_prefix) and filename.endswith(".csv"):
+            listed_filenames.add(filename)
+            if filename in files:
+                continue
+
             # Construct the full public HTTP URL for downloading the file.
             # urljoin combines the base public URL with the S3 key.
             full_download_url = urljoin("https://crowding.data.tfl.gov.uk/", s3_key)
@@ -102,13 +202,30 @@ def get_network_demand_files(base_url, s3_prefix, filename_prefix, save_folder):
             # Define the local path to save the file.
             local_file_path = os.path.join(save_folder, filename)
 
-            # Download the file.
-            downloaded_path = download_file(full_download_url, local_file_path)
+            download_jobs.append((full_download_url, local_file_path))
+
+    # Delete the last file once it is no longer on S3 (i.e. it has been split by year).
+    if last_file and last_file not in listed_filenames:
+        print(f"Deleting the last file in '{save_folder}' ({last_file})...")
+        os.remove(os.path.join(save_folder, last_file))
+        remove_cached_parquet(os.path.join(save_folder, last_file))
+        etags.pop(last_file, None)
+
+    # Download the files concurrently; the shared SESSION reuses pooled connections.
+    with ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as executor:
+        downloaded_paths = list(
+            executor.map(lambda job: download_file(*job, etags=etags), download_jobs)
+        )
 
-            if downloaded_path:
-                downloaded_count += 1
+    with open(etags_path, "w") as f:
+        json.dump(etags, f, indent=2)
 
-            time.sleep(0.1)  # Small delay to be polite to the server.
+    # Downloaded files replace their previous version, so drop its cached Parquet copy.
+    for path in downloaded_paths:
+        if path:
+            remove_cached_parquet(path)
+
+    downloaded_count = sum(1 for path in downloaded_paths if path)
 
     print(
         f"\nCompleted: Downloaded {downloaded_count} matching CSV files to '{save_folder}'."
@@ -125,7 +242,7 @@ def load_station_info(file_path):
 
     print(f"Loading station info from '{file_path}'...")
     try:
-        df_loaded = pd.read_excel(file_path)
+        df_loaded = pd.read_excel(file_path, engine="calamine")
         print(f"Successfully loaded {len(df_loaded)} stop points into DataFrame.")
         return df_loaded
 
@@ -134,38 +251,75 @@ def load_station_info(file_path):
         return pd.DataFrame()
 
 
+def load_footfall_table(csv_path, read_options, convert_options):
+    """
+    Loads a footfall CSV file as an Arrow table, caching a Parquet copy next to it.
+    The CSV is only parsed again when it is newer than its cached Parquet copy.
+    """
+    parquet_path = os.path.splitext(csv_path)[0] + ".parquet"
+
+    if os.path.exists(parquet_path) and os.path.getmtime(
+        parquet_path
+    ) >= os.path.getmtime(csv_path):
+        return pq.read_table(parquet_path)
+
+    table_loaded = pacsv.read_csv(
+        csv_path, read_options=read_options, convert_options=convert_options
+    )
+    # The cache is only a speed-up: if it can't be written, still use the parsed CSV.
+    try:
+        pq.write_table(table_loaded, parquet_path)
+    except Exception as e:
+        print(f"  Error caching {csv_path} as Parquet: {e}")
+    return table_loaded
+
+
 def make_station_footfall_dataframe(folder_path):
 
-    # Empty list to store DataFrames from each CSV file.
-    all_footfall_dfs = []
+    # Empty list to store Arrow tables from each CSV file.
+    all_footfall_tables = []
 
-    # Custom column names
-    custom_headers = ["date", "weekday", "station", "entries", "exits"]
+    # Replace the CSV header row with custom column names and a fixed schema.
+    read_options = pacsv.ReadOptions(column_names=FOOTFALL_CSV_HEADERS, skip_rows=1)
+    convert_options = pacsv.ConvertOptions(column_types=FOOTFALL_CSV_COLUMN_TYPES)
 
-    # Loops through Excel files in alphabetical order (which sorts by year).
-    for excel_file in sorted(os.listdir(folder_path)):
-        full_excel_path = os.path.join(folder_path, excel_file)
+    # Loops through CSV files in alphabetical order (which sorts by year).
+    for csv_file in sorted(f for f in os.listdir(folder_path) if f.endswith(".csv")):
+        full_csv_path = os.path.join(folder_path, csv_file)
 
         try:
-            df_loaded = pd.read_csv(full_excel_path, header=0, names=custom_headers)
+            # Unchanged years are read from their cached Parquet copy.
+            table_loaded = load_footfall_table(
+                full_csv_path, read_options, convert_options
+            )
 
-            # Append the loaded DataFrame to our list.
-            all_footfall_dfs.append(df_loaded)
+            # Append the loaded table to our list.
+            all_footfall_tables.append(table_loaded)
 
         except Exception as e:
-            print(f"  Error reading or processing {excel_file}: {e}. Skipping.")
+            print(f"  Error reading or processing {csv_file}: {e}. Skipping.")
 
-    # Concatenate all DataFrames in the list into a single DataFrame.
-    df_station_footfall = pd.concat(all_footfall_dfs, ignore_index=True)
+    # Concatenate all tables in the list into a single Arrow table.
+    # The tables share one schema, so this references the existing buffers without copying.
+    table_station_footfall = pa.concat_tables(all_footfall_tables)
+    del all_footfall_tables
 
-    # Convert 'date' column to datetime objects
-    df_station_footfall["date"] = pd.to_datetime(
-        df_station_footfall["date"], format="%Y%m%d"
+    # Calculate total station count (entries + exits)
+    table_station_footfall = table_station_footfall.append_column(
+        "total_count",
+        pc.add(table_station_footfall["entries"], table_station_footfall["exits"]),
     )
 
-    # Calculate total station count (entries + exits)
-    df_station_footfall["total_count"] = (
-        df_station_footfall["entries"] + df_station_footfall["exits"]
+    # Convert column by column, releasing each Arrow buffer once it has been converted.
+    df_station_footfall = table_station_footfall.to_pandas(
+        split_blocks=True, self_destruct=True
+    )
+    del table_station_footfall
+
+    # Convert 'date' column to datetime objects using integer arithmetic (no string parsing)
+    dates = df_station_footfall["date"]
+    df_station_footfall["date"] = pd.to_datetime(
+        dict(year=dates // 10000, month=dates // 100 % 100, day=dates % 100)
     )
 
     print("\nDataFrame head after date conversion and total_count calculation:")
@@ -228,13 +382,13 @@ def combine_station_ids_and_footfall(df_station_info, df_station_footfall):
     # --- Apply the cleaning function to create temporary merge columns ---
 
     # Create a new column in df_station_info for merging
-    df_station_info["merge_key"] = df_station_info["station"].apply(
-        clean_station_name_for_merge
+    df_station_info["merge_key"] = clean_station_names_for_merge(
+        df_station_info["station"]
     )
 
     # Create a new column in df_footfall_baseline for merging
-    df_station_footfall["merge_key"] = df_station_footfall["station"].apply(
-        clean_station_name_for_merge
+    df_station_footfall["merge_key"] = clean_station_names_for_merge(
+        df_station_footfall["station"]
     )
 
     # Remove the station name from footfall dataframe.
@@ -243,11 +397,18 @@ def combine_station_ids_and_footfall(df_station_info, df_station_footfall):
 
     # --- Create DataFrame with Station Name and Footfall Baseline (i.e., Max Footfall) ---
 
+    # Aggregate with Arrow, which groups directly on the dictionary-encoded merge keys
     df_footfall_baseline = (
-        df_station_footfall.groupby("merge_key")["total_count"].max().reset_index()
+        pa.Table.from_pandas(
+            df_station_footfall[["merge_key", "total_count"]], preserve_index=False
+        )
+        .group_by("merge_key")
+        .aggregate([("total_count", "max")])
+        .to_pandas()
+        .dropna(subset=["merge_key"])
     )
     df_footfall_baseline = df_footfall_baseline.rename(
-        columns={"total_count": "footfall_baseline"}
+        columns={"total_count_max": "footfall_baseline"}
     )
 
     # --- Merge df_footfall_baseline into df_station_info DataFrame. ---
@@ -272,35 +433,44 @@ def clean_station_name_for_merge(name):
     """
     Cleans a station name by removing non-alphanumeric characters (except spaces)
     and standardizing whitespace. Converts to lowercase.
+    Footfall names listed in STATION_NAME_RENAMES are first renamed to their API names.
+    This is the only implementation of the cleaning rules; clean_station_names_for_merge
+    applies it once per distinct name.
     """
     if pd.isna(name):  # Handle NaN values
         return name
 
     # Change names from footfall data to match names from station info data (from API)
-    if name == "Edgware Road B":
-        name = "Edgware Road (Bakerloo)"
-    if name == "Edgware Road C&H":
-        name = "Edgware Road (Circle Line)"
-    if name == "Heathrow Terminals 2&3":
-        name = "Heathrow Terminals 2 & 3"
-    if name == "Hammersmith C&H":
-        name = "Hammersmith (H&C Line)"
-    if name == "Hammersmith D&P":
-        name = "Hammersmith (Dist&Picc Line)"
-    if name == "Shepherds Bush":
-        name = "Shepherd's Bush (Central)"
-    if name == "Watford Met":
-        name = "Watford"
+    name = STATION_NAME_RENAMES.get(name, name)
 
     name = str(name).lower()  # Convert to string and lowercase
     # Remove any characters that are not letters, numbers, or spaces
-    name = re.sub(r"[^a-z0-9\s]", "", name)
+    name = NON_ALPHANUMERIC_PATTERN.sub("", name)
     # Replace multiple spaces with a single space and strip leading/trailing spaces
-    name = re.sub(r"\s+", " ", name).strip()
+    name = MULTIPLE_WHITESPACE_PATTERN.sub(" ", name).strip()
 
     return name
 
 
+def clean_station_names_for_merge(names):
+    """
+    Vectorized version of clean_station_name_for_merge for a Series of station names.
+    Each distinct name is cleaned once with clean_station_name_for_merge and the result
+    is broadcast back to every row as a categorical (dictionary-encoded) Series.
+    """
+    codes, unique_names = pd.factorize(names, use_na_sentinel=False)
+
+    cleaned_names = pd.Series(unique_names).map(clean_station_name_for_merge)
+
+    # Different raw names can clean to the same key, so factorize the cleaned names again
+    cleaned_codes, merge_keys = pd.factorize(cleaned_names)
+
+    return pd.Series(
+        pd.Categorical.from_codes(cleaned_codes[codes], categories=merge_keys),
+        index=names.index,
+    )
+
+
 # --- Main Execution ---
 if __name__ == "__main__":
 
@@ -320,11 +490,21 @@ if __name__ == "__main__":
 
     df_stations = combine_station_ids_and_footfall(df_station_info, df_station_footfall)
 
-# # --- Data Saving Phase ---
+    # # --- Data Saving Phase ---
 
-# Saves the final combined DataFrame to an Excel file (without DataFrame index).
-print(f"Saving df_stations to '{FILE_PATH_FOOTFALL_BASELINE}'...")
-df_stations.to_excel(FILE_PATH_FOOTFALL_BASELINE, index=False)
+    # Saves the final combined DataFrame to an Excel file (without DataFrame index).
+    # xlsxwriter is a write-only engine and is considerably faster than openpyxl.
+    print(f"Saving df_stations to '{FILE_PATH_FOOTFALL_BASELINE}'...")
+    df_stations.to_excel(FILE_PATH_FOOTFALL_BASELINE, index=False, engine="xlsxwriter")
+
+    print(f"Saving df_stations to '{FILE_PATH_FOOTFALL_BASELINE_PARQUET}'...")
+    df_stations_parquet = df_stations.astype({"stop_id": str})
+    # The maximum baseline is saved in the Parquet metadata (restored as DataFrame.attrs),
+    # so Get_Live_Crowding can read it instead of scanning the column on every run.
+    df_stations_parquet.attrs["max_footfall_baseline"] = float(
+        df_stations["footfall_baseline"].max()
+    )
+    df_stations_parquet.to_parquet(FILE_PATH_FOOTFALL_BASELINE_PARQUET, index=False)
 
-print("Data combination and saving process completed.")
-print("\n--- Script Execution Finished ---")
+    print("Data combination and saving process completed.")
+    print("\n--- Script Execution Finished ---")
@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 
-import requests
-import time
+import asyncio
+import aiohttp
+from aiolimiter import AsyncLimiter
 import json
+import orjson
 import os
+from functools import lru_cache
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+import random
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
@@ -12,11 +18,16 @@ import pytz
 
 # --- API Endpoints and File Paths ---
 TFL_STOPPOINT_URL = "https://api.tfl.gov.uk/crowding/{Naptan}/Live"
+# Loaded from their Parquet copies (written by Get_Tube_Stations/Calculate_Baseline_Footfall)
 FILE_PATH_STATION_INFO = "data/station_info.xlsx"  # Needed for JSON generation
 FILE_PATH_STATION_FOOTFALL_BASELINE = "data/stations_baseline_footfall.xlsx"
 OUTPUT_HTML_JSON_FILE = (
     "data/live_crowding_for_heatmap.json"  # Local JSON output for HTML
 )
+# Local history of live crowding data (source for the JSON; the Google Sheet is a mirror).
+# It only lives on the machine running this script (it is not committed); when it is
+# missing, it is seeded again from the Google Sheet.
+FILE_PATH_LIVE_CROWDING_HISTORY = "data/live_crowding_history.parquet"
 
 # --- Configuration from Environment Variables ---
 # TFL API Key for querying TfL data
@@ -29,44 +40,110 @@ GOOGLE_WORKSHEET_NAME = "stations_live_crowding"  # Always save to Sheet1
 
 # --- Data Retention Configuration ---
 MAX_ROWS_GOOGLE_SHEET = 100000  # Maximum desired rows in Google Sheet
+MAX_ROWS_LOCAL_HISTORY = (
+    MAX_ROWS_GOOGLE_SHEET  # Keep the same history as the Google Sheet
+)
+
+# --- API Concurrency Configuration ---
+MAX_CONCURRENT_REQUESTS = 64  # Maximum number of TfL API requests in flight at once
+MAX_REQUESTS_PER_MINUTE = 500  # TfL rate limit for requests made with an app_key
+MAX_RETRIES = 5  # Attempts per TfL API request
+RETRY_INITIAL_DELAY = 0.2  # Seconds before the first retry (doubled for each retry)
+RETRY_MAX_DELAY = 5  # Maximum seconds between retries
+# One pooled keep-alive connection to api.tfl.gov.uk per request in flight, so no request
+# waits in the connector queue while its timeout runs
+MAX_CONNECTIONS_PER_HOST = MAX_CONCURRENT_REQUESTS
+KEEPALIVE_TIMEOUT = 30  # Seconds an idle pooled connection is kept open for reuse
+DNS_CACHE_TTL = 300  # Seconds a resolved api.tfl.gov.uk address is reused
 
 # --- Timezone Configuration  ---
 LONDON_TIMEZONE = pytz.timezone("Europe/London")
 
 
-def query_TFL(
+async def query_TFL(
+    session: aiohttp.ClientSession,
     url: str,
-    params: dict = None,
-    max_retries: int = 3,
-    _session: requests.Session = None,
+    params: dict,
+    semaphore: asyncio.Semaphore,
+    rate_limiter: AsyncLimiter,
+    max_retries: int = MAX_RETRIES,
 ) -> list:
-    """Queries the TfL API with retry logic."""
-    session_to_use = _session if _session else requests.Session()
+    """
+    Queries the TfL API asynchronously with retry logic.
+    Network errors, timeouts, HTTP 5xx and HTTP 429 are retried with exponential backoff
+    and jitter (honouring Retry-After on 429); other errors fail immediately.
+    Every attempt (retries included) takes a slot of the shared semaphore (requests in
+    flight) and rate limiter (requests per minute); neither is held while backing off.
+    """
     for retry_attempt in range(max_retries):
         try:
-            response = session_to_use.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            json_response = response.json()
-            return json_response if json_response else []
-        except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+            async with semaphore, rate_limiter:
+                async with session.get(url, params=params) as response:
+                    response.raise_for_status()
+                    try:
+                        json_response = await response.json(content_type=None)
+                    except json.JSONDecodeError as e:
+                        # A malformed body won't be fixed by retrying
+                        raise RuntimeError(f"Invalid JSON response from {url}: {e}")
+                    return json_response if json_response else []
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             print(
                 f"Error querying TfL API (Attempt {retry_attempt + 1}/{max_retries}): {e}"
             )
-            if retry_attempt == max_retries - 1:
+            status = e.status if isinstance(e, aiohttp.ClientResponseError) else None
+            retryable = status is None or status == 429 or status >= 500
+            if not retryable or retry_attempt == max_retries - 1:
                 raise RuntimeError(
-                    f"Failed to fetch data from {url} after {max_retries} retries: {e}"
+                    f"Failed to fetch data from {url} after {retry_attempt + 1} attempts: {e}"
                 )
-        time.sleep(0.1)  # Small delay between retries
+
+            # Exponential backoff with jitter, so concurrent requests don't retry in lockstep
+            delay = min(
+                RETRY_MAX_DELAY,
+                RETRY_INITIAL_DELAY * 2**retry_attempt
+                + random.uniform(0, RETRY_INITIAL_DELAY),
+            )
+            # When rate limited, wait as long as the API asks (if it says)
+            retry_after = (
+                (e.headers or {}).get("Retry-After") if status == 429 else None
+            )
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            await asyncio.sleep(delay)
     return []
 
 
-def load_excel_file(file_path):
-    """Loads an Excel file into a Pandas DataFrame."""
+async def fetch_all_station_crowding(urls, params):
+    """
+    Fetches live crowding for all station URLs concurrently.
+    Returns the responses (or raised exceptions) in the same order as the URLs.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    rate_limiter = AsyncLimiter(MAX_REQUESTS_PER_MINUTE, 60)
+    # Requests are queued for a pooled connection rather than each opening a new one,
+    # so TLS handshakes are limited to the pool size and reused across all stations
+    connector = aiohttp.TCPConnector(
+        limit_per_host=MAX_CONNECTIONS_PER_HOST,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=DNS_CACHE_TTL,
+    )
+    timeout = aiohttp.ClientTimeout(total=10)
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=timeout
+    ) as session:  # Use a single session for all API calls
+        tasks = [
+            query_TFL(session, url, params, semaphore, rate_limiter) for url in urls
+        ]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def load_parquet_file(file_path, columns=None):
+    """Loads (selected columns of) a Parquet file into a Pandas DataFrame."""
     if not os.path.exists(file_path):
         print(f"Warning: File not found at '{file_path}'. Returning empty DataFrame.")
         return pd.DataFrame()
     try:
-        df_loaded = pd.read_excel(file_path)
+        df_loaded = pd.read_parquet(file_path, columns=columns, engine="pyarrow")
         print(f"Successfully loaded {len(df_loaded)} rows from '{file_path}'.")
         return df_loaded
     except Exception as e:
@@ -74,80 +151,102 @@ def load_excel_file(file_path):
         return pd.DataFrame()
 
 
-def get_Live_Crowding(tfl_url_pattern, df_stations_for_api):
+def load_excel_file_cached(file_path, columns=None):
+    """
+    Loads (selected columns of) an Excel file through its Parquet copy (same name, .parquet).
+    The Parquet copy is only (re)written from the Excel file when it is missing or older.
+    """
+    parquet_path = os.path.splitext(file_path)[0] + ".parquet"
+    if os.path.exists(file_path) and (
+        not os.path.exists(parquet_path)
+        or os.path.getmtime(parquet_path) < os.path.getmtime(file_path)
+    ):
+        try:
+            print(f"Caching '{file_path}' as '{parquet_path}'...")
+            df_excel = pd.read_excel(file_path, engine="calamine")
+            if "stop_id" in df_excel.columns:
+                df_excel["stop_id"] = df_excel["stop_id"].astype(str)
+            if "footfall_baseline" in df_excel.columns:
+                # Store the maximum in the metadata, as Calculate_Baseline_Footfall does
+                df_excel.attrs["max_footfall_baseline"] = float(
+                    df_excel["footfall_baseline"].max()
+                )
+            df_excel.to_parquet(parquet_path, index=False)
+        except Exception as e:
+            print(f"Error caching '{file_path}' as Parquet: {e}")
+            return pd.DataFrame()
+
+    return load_parquet_file(parquet_path, columns=columns)
+
+
+async def get_Live_Crowding(
+    tfl_url_pattern, df_stations_for_api, max_baseline_footfall=None
+):
     """
     Fetches live crowding data for stations and returns a DataFrame
     containing only stop_id, crowding_metric, and timestamp, in the specified order.
+    The maximum footfall baseline is computed from df_stations_for_api if not given.
+    stop_id is expected to already hold strings (NaPTAN codes).
     """
     api_params = {"app_key": TFL_API_KEY}
     current_timestamp = datetime.now(LONDON_TIMEZONE)  # Timezone-aware timestamp
 
     print("Fetching live crowding data...")
-    all_live_data_for_sheet = []  # To collect data for the Google Sheet
-
-    # Calculate max_baseline_footfall here, as it's needed for crowding_metric calculation in get_Live_Crowding
-    max_baseline_footfall = df_stations_for_api["footfall_baseline"].max()
-
-    with requests.Session() as session:  # Use a single session for all API calls
-        for (
-            idx,
-            station_row,
-        ) in df_stations_for_api.iterrows():  # Renamed parameter for clarity
-            station_id = str(
-                station_row["stop_id"]
-            )  # Ensure stop_id is string for API call
-            baseline_footfall = station_row["footfall_baseline"]  # Used for calculation
-
-            current_station_url = tfl_url_pattern.format(Naptan=station_id)
-
-            try:
-                response = query_TFL(current_station_url, api_params, _session=session)
-                percentage_value = response.get("percentageOfBaseline")
-
-                if percentage_value is not None:
-
-                    crowding_metric = (
-                        (baseline_footfall * percentage_value) / max_baseline_footfall
-                    ) * 100
-
-                    # Ensure crowding_metric is not infinite or NaN
-                    if pd.isna(crowding_metric) or np.isinf(crowding_metric):
-                        crowding_metric = 0.0  # Default to 0 for invalid calculations
-
-                    all_live_data_for_sheet.append(
-                        {
-                            "stop_id": station_id,
-                            "timestamp": current_timestamp,
-                            "crowding_metric": float(
-                                crowding_metric
-                            ),  # Save crowding_metric
-                        }
-                    )
-                else:
-                    print(
-                        f"No 'percentageOfBaseline' found for {station_id}. Skipping this data point for sheet."
-                    )
-
-                time.sleep(0.05)  # Delay between API calls to avoid rate limits
-
-            except RuntimeError as e:
-                print(f"API call failed for {station_id}: {e}")
-            except Exception as e:
-                print(f"Unexpected error for {station_id}: {e}")
-
-    # Create the DataFrame with only the desired columns for the Google Sheet
-    df_live_crowding_for_sheet = pd.DataFrame(all_live_data_for_sheet)
-
-    if not df_live_crowding_for_sheet.empty:
-        # Ensure correct types after DataFrame creation
-        df_live_crowding_for_sheet["stop_id"] = df_live_crowding_for_sheet[
-            "stop_id"
-        ].astype(str)
-        df_live_crowding_for_sheet["crowding_metric"] = df_live_crowding_for_sheet[
-            "crowding_metric"
-        ].astype(float)
-        df_live_crowding_for_sheet["timestamp"] = pd.to_datetime(
-            df_live_crowding_for_sheet["timestamp"]
+
+    # Calculate max_baseline_footfall here (unless precomputed), as it's needed for crowding_metric calculation in get_Live_Crowding
+    if max_baseline_footfall is None:
+        max_baseline_footfall = df_stations_for_api["footfall_baseline"].max()
+
+    # Plain NumPy array of stop_ids (avoids boxing every row as a Series)
+    station_ids = df_stations_for_api["stop_id"].to_numpy()
+    station_urls = [
+        tfl_url_pattern.format(Naptan=station_id) for station_id in station_ids
+    ]
+    responses = await fetch_all_station_crowding(station_urls, api_params)
+
+    # Live percentage of baseline per station (in station order), NaN where unavailable.
+    # A preallocated float array keeps the arithmetic below in NumPy.
+    live_percentages = np.full(len(station_ids), np.nan)
+
+    for i, (station_id, response) in enumerate(
+        zip(station_ids, responses)
+    ):  # Responses are returned in the same order as the stations
+        try:
+            if isinstance(response, Exception):
+                raise response  # Surface errors returned by asyncio.gather
+            percentage_value = response.get("percentageOfBaseline")
+
+            if percentage_value is not None:
+                live_percentages[i] = percentage_value
+            else:
+                print(
+                    f"No 'percentageOfBaseline' found for {station_id}. Skipping this data point for sheet."
+                )
+
+        except RuntimeError as e:
+            print(f"API call failed for {station_id}: {e}")
+        except Exception as e:
+            print(f"Unexpected error for {station_id}: {e}")
+
+    # Calculate crowding_metric for all stations in a single vectorized step
+    has_live_data = ~np.isnan(live_percentages)
+    baseline_footfall = df_stations_for_api["footfall_baseline"].to_numpy(dtype=float)
+    crowding_metric = (
+        (baseline_footfall[has_live_data] * live_percentages[has_live_data])
+        / max_baseline_footfall
+    ) * 100
+
+    if has_live_data.any():
+        # Build only the columns needed for the Google Sheet (no copy of the stations DataFrame)
+        df_live_crowding_for_sheet = pd.DataFrame(
+            {
+                "stop_id": station_ids[has_live_data],
+                "timestamp": current_timestamp,
+                # Ensure crowding_metric is not infinite or NaN (default to 0 for invalid calculations)
+                "crowding_metric": np.nan_to_num(
+                    crowding_metric, nan=0.0, posinf=0.0, neginf=0.0
+                ),
+            }
         )
     else:  # Ensure columns are correct even if no data fetched
         df_live_crowding_for_sheet = pd.DataFrame(
@@ -167,38 +266,93 @@ def get_Live_Crowding(tfl_url_pattern, df_stations_for_api):
     return df_live_crowding_for_sheet
 
 
+def append_to_local_history(
+    df_history: pd.DataFrame, df_new: pd.DataFrame, history_path: Optional[str]
+) -> pd.DataFrame:
+    """
+    Appends new live crowding data to the local history and saves it to Parquet
+    (not saved if history_path is None). Timestamps are stored like in the Google Sheet
+    (UTC, whole seconds), and only the latest MAX_ROWS_LOCAL_HISTORY rows are kept.
+    """
+    # A common timestamp dtype keeps the concatenated column datetime (not object)
+    df_new = df_new.assign(
+        timestamp=df_new["timestamp"].astype("datetime64[ns, UTC]").dt.floor("s")
+    )
+    if not df_history.empty:
+        df_history = df_history.assign(
+            timestamp=df_history["timestamp"].astype("datetime64[ns, UTC]")
+        )
+        df_new = pd.concat([df_history, df_new], ignore_index=True)
+    df_history = df_new.tail(MAX_ROWS_LOCAL_HISTORY).reset_index(drop=True)
+
+    if history_path is None:
+        return df_history
+
+    try:
+        os.makedirs(os.path.dirname(history_path), exist_ok=True)
+        df_history.to_parquet(history_path, index=False, engine="pyarrow")
+        print(f"Saved {len(df_history)} rows of history to '{history_path}'.")
+    except Exception as e:
+        print(f"Error saving history to '{history_path}': {e}")
+    return df_history
+
+
+@lru_cache(maxsize=None)
+def open_google_spreadsheet(
+    sheet_id: str, credentials_path: str
+) -> gspread.Spreadsheet:
+    """
+    Opens a Google Sheet, authenticating only once per run.
+    The client (and its pooled HTTP session) is shared by the save and the load,
+    so they skip the second token request, TLS handshake and spreadsheet lookup.
+    """
+    gc = gspread.service_account(filename=credentials_path)
+    return gc.open_by_key(sheet_id)
+
+
 def load_historical_data_from_google_sheet(
     sheet_id: str, worksheet_name: str, credentials_path: str
-) -> pd.DataFrame:
+) -> Optional[pd.DataFrame]:
     """
     Loads all historical data from a Google Sheet worksheet into a Pandas DataFrame.
-    Returns an empty DataFrame if the sheet or worksheet is empty or inaccessible.
+    Returns an empty DataFrame if the worksheet is empty or does not exist yet,
+    and None if the sheet could not be read (so callers can tell the two apart).
     """
     if not os.path.exists(credentials_path):
         print(f"Error: Google credentials file not found at {credentials_path}")
-        return pd.DataFrame()
+        return None
 
     if not sheet_id:
         print("Error: Google Sheet ID not provided.")
-        return pd.DataFrame()
+        return None
 
     try:
-        gc = gspread.service_account(filename=credentials_path)
-        spreadsheet = gc.open_by_key(sheet_id)
+        spreadsheet = open_google_spreadsheet(sheet_id, credentials_path)
         worksheet = spreadsheet.worksheet(worksheet_name)
 
-        # Get all records as a list of dictionaries
-        data = worksheet.get_all_records()
-        if not data:
+        # Get all values (stop_id, timestamp, crowding_metric) as a 2D list in one request.
+        # Unformatted values return numbers as numbers, so they need no string parsing.
+        rows = worksheet.get(
+            f"A1:C{worksheet.row_count}",
+            value_render_option=gspread.utils.ValueRenderOption.unformatted,
+            pad_values=True,
+        )
+        if len(rows) < 2:
             print(f"Worksheet '{worksheet_name}' is empty or contains only headers.")
             return pd.DataFrame()
 
-        df = pd.DataFrame(data)
+        df = pd.DataFrame(rows[1:], columns=rows[0])
 
         # Ensure correct data types for processing, especially for timestamp and stop_id
         if "timestamp" in df.columns:
-            # Convert to datetime and then localize to London timezone
-            df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
+            # Timestamps are stored as UTC strings (see save_dataframe_to_google_sheet),
+            # so an explicit format avoids per-row format inference
+            df["timestamp"] = pd.to_datetime(
+                df["timestamp"],
+                format="%Y-%m-%dT%H:%M:%SZ",
+                utc=True,
+                errors="coerce",
+            )
         if "stop_id" in df.columns:
             df["stop_id"] = df["stop_id"].astype(
                 str
@@ -220,10 +374,17 @@ def load_historical_data_from_google_sheet(
         return pd.DataFrame()
     except gspread.exceptions.APIError as e:
         print(f"Error loading from Google Sheet (API): {e.response.text}")
-        return pd.DataFrame()
+        return None
     except Exception as e:
         print(f"Error loading from Google Sheet: {e}")
-        return pd.DataFrame()
+        return None
+
+
+def _to_sheet_cell(value) -> dict:
+    """Converts a Python value to a Sheets API CellData dict (numbers or strings)."""
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+        return {"userEnteredValue": {"numberValue": float(value)}}
+    return {"userEnteredValue": {"stringValue": str(value)}}
 
 
 def save_dataframe_to_google_sheet(
@@ -246,38 +407,62 @@ def save_dataframe_to_google_sheet(
         return
 
     try:
-        gc = gspread.service_account(filename=credentials_path)
-        spreadsheet = gc.open_by_key(sheet_id)
+        spreadsheet = open_google_spreadsheet(sheet_id, credentials_path)
 
+        created_worksheet = False
         try:
             worksheet = spreadsheet.worksheet(worksheet_name)
         except gspread.exceptions.WorksheetNotFound:
-            # Create with minimal rows/cols; gspread will expand as needed
+            # Size the grid for the header and the first batch, so appending doesn't have to grow it
             worksheet = spreadsheet.add_worksheet(
-                title=worksheet_name, rows="1", cols="1"
+                title=worksheet_name, rows=len(df) + 1, cols=len(df.columns)
             )
+            created_worksheet = True
             print(f"Created new worksheet: {worksheet_name}")
 
-        # Get current row count (including header and empty rows)
-        current_total_rows = worksheet.row_count
+        # Get current row count (including header and empty rows); a new worksheet holds no data yet
+        current_total_rows = 0 if created_worksheet else worksheet.row_count
         rows_to_add = len(df)
 
         # Determine if headers need to be written
-        # Assumes if row_count is 0, or 1 and A1 is empty, then headers are needed
-        # Otherwise, assume headers already exist
-        needs_headers = (current_total_rows == 0) or (
-            current_total_rows == 1 and not worksheet.acell("A1").value
-        )
-
-        # If headers are needed, write them first
+        # A worksheet created above (or without rows) is known to be empty: headers are needed.
+        # A single-row worksheet is either empty or holds only the headers. Rather than
+        # reading A1 to find out (an extra API call), row 1 is (re)written with the headers,
+        # which is correct either way. Otherwise, assume headers already exist
+        needs_headers = created_worksheet or (current_total_rows == 0)
+        rewrite_header_row = not needs_headers and (current_total_rows == 1)
+
+        # If headers are needed, they are sent in the same request as the data rows
+        header_rows = []
         if needs_headers:
             print(f"Worksheet '{worksheet_name}' is empty. Appending headers.")
-            worksheet.append_rows([df.columns.values.tolist()])
-            current_total_rows = (
-                worksheet.row_count
-            )  # Update count after adding headers
+            header_rows = [df.columns.values.tolist()]
+
+        # Sheet mutations, sent together in a single batchUpdate request
+        batch_requests = []
+
+        if rewrite_header_row:
+            print(
+                f"Worksheet '{worksheet_name}' has a single row. Writing headers to it."
+            )
+            batch_requests.append(
+                {
+                    "updateCells": {
+                        "start": {
+                            "sheetId": worksheet.id,
+                            "rowIndex": 0,
+                            "columnIndex": 0,
+                        },
+                        "rows": [
+                            {"values": [_to_sheet_cell(value) for value in df.columns]}
+                        ],
+                        "fields": "userEnteredValue",
+                    }
+                }
+            )
 
         # --- Trimming Logic (before appending new data) ---
+        rows_to_delete = 0
         if (current_total_rows + rows_to_add) > MAX_ROWS_GOOGLE_SHEET:
             rows_to_delete = rows_to_add  # Delete a chunk equal to the new data size
 
@@ -298,10 +483,18 @@ def save_dataframe_to_google_sheet(
                 print(f"Adjusted deletion: will delete {rows_to_delete} rows.")
 
             if rows_to_delete > 0:
-                # Perform the deletion
-                worksheet.delete_rows(delete_start_index, delete_end_index)
-                print(
-                    f"Successfully deleted rows {delete_start_index}-{delete_end_index}."
+                # Queue the deletion; it is sent in the same request as the new rows
+                batch_requests.append(
+                    {
+                        "deleteDimension": {
+                            "range": {
+                                "sheetId": worksheet.id,
+                                "dimension": "ROWS",
+                                "startIndex": delete_start_index - 1,  # 0-based
+                                "endIndex": delete_end_index,  # Exclusive
+                            }
+                        }
+                    }
                 )
             else:
                 print(
@@ -309,22 +502,38 @@ def save_dataframe_to_google_sheet(
                 )
 
         # --- Prepare DataFrame for Google Sheets appending ---
-        df_to_append = df.copy()
+        # Convert Timestamp column to UTC strings for Sheets (assign avoids a full copy first)
+        df_to_append = df.assign(
+            timestamp=df["timestamp"]
+            .dt.tz_convert("UTC")
+            .dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+        )
 
         # Fill NaN values in 'crowding_metric' with 0 to make it JSON compliant for gspread
         if "crowding_metric" in df_to_append.columns:
             df_to_append["crowding_metric"] = df_to_append["crowding_metric"].fillna(0)
 
-        # Convert Timestamp column to string before appending (as in original code)
-        df_to_append["timestamp"] = (
-            df_to_append["timestamp"]
-            .dt.tz_convert("UTC")
-            .dt.strftime("%Y-%m-%dT%H:%M:%SZ")
-        )  # Convert to UTC string for Sheets
+        # --- Append headers (if needed) and new data rows after the last row with data ---
+        # Values are stored as sent (like RAW input), so Sheets does no per-cell parsing
+        batch_requests.append(
+            {
+                "appendCells": {
+                    "sheetId": worksheet.id,
+                    "rows": [
+                        {"values": [_to_sheet_cell(value) for value in row]}
+                        for row in header_rows
+                        + df_to_append.to_numpy(dtype=object).tolist()
+                    ],
+                    "fields": "userEnteredValue",
+                }
+            }
+        )
 
-        # --- Append new data rows ---
+        # --- Apply the deletion and the append in one atomic batchUpdate call ---
         print(f"Appending {rows_to_add} new rows to Google Sheet '{worksheet_name}'...")
-        worksheet.append_rows(df_to_append.values.tolist())
+        spreadsheet.batch_update({"requests": batch_requests})
+        if rows_to_delete > 0:
+            print(f"Successfully deleted rows {delete_start_index}-{delete_end_index}.")
 
         print(
             f"DataFrame operations completed for Google Sheet '{spreadsheet.title}' (Worksheet: '{worksheet_name}')."
@@ -352,107 +561,120 @@ def generate_heatmap_json(
         os.makedirs(
             os.path.dirname(output_json_path), exist_ok=True
         )  # Ensure dir exists
-        with open(output_json_path, "w") as f:
-            json.dump({}, f)
+        with open(output_json_path, "wb") as f:
+            f.write(orjson.dumps({}))
         return
 
     # Ensure 'timestamp' is datetime and sort for proper grouping
     # This df_live_crowding should already be timezone-aware from load_historical_data_from_google_sheet
-    df_live_crowding = df_live_crowding.sort_values("timestamp").reset_index(drop=True)
+    # ignore_index renumbers the rows during the sort, without a second copy from reset_index
+    df_live_crowding = df_live_crowding.sort_values("timestamp", ignore_index=True)
 
     # Merge station info and baseline into live crowding data for calculations
     # This creates a combined DataFrame for processing each time unit
+    # Only the needed columns are merged, with stop_id as the same categorical on both
+    # sides, so the merge matches integer codes instead of hashing strings
+    stop_id_dtype = pd.CategoricalDtype(
+        np.union1d(
+            df_live_crowding["stop_id"].unique(), df_station_info["stop_id"].unique()
+        )
+    )
     df_combined_data = pd.merge(
-        df_live_crowding,
-        df_station_info[["stop_id", "station", "lat", "lon"]],
+        df_live_crowding[["stop_id", "timestamp", "crowding_metric"]].astype(
+            {"stop_id": stop_id_dtype}
+        ),
+        df_station_info[["stop_id", "station", "lat", "lon"]].astype(
+            {"stop_id": stop_id_dtype}
+        ),
         on="stop_id",
         how="left",
+        copy=False,
     )
     df_combined_data["lat"] = pd.to_numeric(df_combined_data["lat"], errors="coerce")
     df_combined_data["lon"] = pd.to_numeric(df_combined_data["lon"], errors="coerce")
     df_combined_data["station"] = df_combined_data["station"].astype(
         str
     )  # Ensure station names are strings
-
-    processed_all_data = {}
+    # Categoricals store each station once and group on integer codes
+    df_combined_data["station"] = df_combined_data["station"].astype("category")
+
+    # Time unit columns for every resolution, computed once up front on df_combined_data
+    # .dt methods work correctly with timezone-aware datetimes
+    timestamps = df_combined_data["timestamp"]
+    df_combined_data["hour_unit"] = timestamps.dt.round("h")
+    df_combined_data["day_unit"] = timestamps.dt.normalize()
+    # Ensure week_start is Monday (weeks ending on Sunday), without a per-row lambda
+    df_combined_data["week_unit"] = timestamps.dt.to_period("W-SUN").dt.start_time
+    resolution_columns = {
+        "hourly": "hour_unit",
+        "daily": "day_unit",
+        "weekly": "week_unit",
+    }
 
     # --- Helper to process data for a specific resolution ---
-    def _process_resolution_data(df_data_to_group, resolution_type):
-        res_data = {}
-
-        # Determine the time grouping column - .dt methods work correctly with timezone-aware datetimes
-        if resolution_type == "hourly":
-            df_data_to_group["time_unit"] = df_data_to_group["timestamp"].dt.round("h")
-
-        elif resolution_type == "daily":
-            df_data_to_group["time_unit"] = df_data_to_group["timestamp"].dt.normalize()
-        elif resolution_type == "weekly":
-            # Ensure week_start is Monday
-            df_data_to_group["time_unit"] = (
-                df_data_to_group["timestamp"]
-                .dt.to_period("W")
-                .apply(lambda r: r.start_time)
-            )
-        else:
-            raise ValueError("Invalid resolution type for JSON generation")
-
+    def _process_resolution_data(res_col):
         # Group data and calculate average crowding_metric per station per time unit
-        grouped_agg_data = (
-            df_data_to_group.groupby(["time_unit", "stop_id"])
-            .agg(
-                crowding_metric=(
-                    "crowding_metric",
-                    "mean",
-                ),
-                station=("station", "first"),  # Keep first station name
-                lat=("lat", "first"),  # Keep first lat
-                lon=("lon", "first"),  # Keep first lon
-            )
-            .reset_index()
+        # (only the time unit column is selected, so df_combined_data is never copied)
+        grouped_agg_data = df_combined_data.groupby(
+            [res_col, "stop_id"], observed=True
+        ).agg(
+            crowding_metric=(
+                "crowding_metric",
+                "mean",
+            ),
+            station=("station", "first"),  # Keep first station name
+            lat=("lat", "first"),  # Keep first lat
+            lon=("lon", "first"),  # Keep first lon
         )
 
-        unique_time_units = sorted(grouped_agg_data["time_unit"].unique())
-
-        for time_unit in unique_time_units:
-            current_time_unit_data = grouped_agg_data[
-                grouped_agg_data["time_unit"] == time_unit
-            ].copy()
+        # The crowding_metric is already calculated, just ensure it's clean
+        # (infinite and NaN values are replaced with 0 in a single NumPy pass)
+        grouped_agg_data["crowding_metric"] = np.nan_to_num(
+            grouped_agg_data["crowding_metric"].to_numpy(dtype=float),
+            nan=0.0,
+            posinf=0.0,
+            neginf=0.0,
+        )
 
-            # The crowding_metric is already calculated, just ensure it's clean
-            current_time_unit_data.loc[:, "crowding_metric"] = (
-                current_time_unit_data["crowding_metric"]
-                .replace([float("inf"), -float("inf")], pd.NA)
-                .fillna(0)  # Replace any remaining NaN with 0
-            )
+        # Convert the whole aggregate to one array, then slice it at the time unit boundaries
+        # (rows are sorted by time_unit, so each time unit is a contiguous block)
+        time_unit_codes, unique_time_units = pd.factorize(
+            grouped_agg_data.index.get_level_values(res_col), sort=True
+        )
+        # Drop rows where lat/lon/station might have been coerced to NaN due to issues
+        has_location = (
+            grouped_agg_data[["lat", "lon", "station"]].notna().all(axis=1).to_numpy()
+        )
+        heatmap_rows = grouped_agg_data.loc[
+            has_location, ["lat", "lon", "crowding_metric", "station"]
+        ].to_numpy()
+        boundaries = np.searchsorted(
+            time_unit_codes[has_location],
+            np.arange(len(unique_time_units)),
+            side="right",
+        )
 
-            # Drop rows where lat/lon/station might have been coerced to NaN due to issues
-            heatmap_data_for_ts = (
-                current_time_unit_data[["lat", "lon", "crowding_metric", "station"]]
-                .dropna(subset=["lat", "lon", "station"])  # Ensure lat/lon are not NaN
-                .values.tolist()
-            )
-            res_data[str(time_unit)] = (
-                heatmap_data_for_ts  # Convert timezone-aware datetime to string for JSON
-            )
+        # Convert timezone-aware datetimes to strings for JSON
+        res_data = {}
+        start = 0
+        for time_unit, end in zip(unique_time_units, boundaries):
+            res_data[str(time_unit)] = heatmap_rows[start:end].tolist()
+            start = end
         return res_data
 
-    # Generate data for each resolution, passing a copy
-    processed_all_data["hourly"] = _process_resolution_data(
-        df_combined_data.copy(), "hourly"
-    )
-    processed_all_data["daily"] = _process_resolution_data(
-        df_combined_data.copy(), "daily"
-    )
-    processed_all_data["weekly"] = _process_resolution_data(
-        df_combined_data.copy(), "weekly"
-    )
-
     # Ensure output directory exists
     os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
 
-    # Save to JSON
-    with open(output_json_path, "w") as f:
-        json.dump(processed_all_data, f, indent=2)
+    # Save to JSON one resolution at a time, so only one resolution's data is held in memory.
+    # orjson encodes much faster than the json module (and no indentation halves the size).
+    with open(output_json_path, "wb") as f:
+        f.write(b"{")
+        for i, (resolution_type, res_col) in enumerate(resolution_columns.items()):
+            if i > 0:
+                f.write(b",")
+            f.write(orjson.dumps(resolution_type) + b":")
+            f.write(orjson.dumps(_process_resolution_data(res_col)))
+        f.write(b"}")
     print(f"Successfully generated heatmap JSON to '{output_json_path}'.")
 
 
@@ -472,8 +694,12 @@ if __name__ == "__main__":
         exit(1)
 
     # --- Data Loading (Static and Baseline) ---
-    df_station_info = load_excel_file(FILE_PATH_STATION_INFO)
-    df_baseline_footfall = load_excel_file(FILE_PATH_STATION_FOOTFALL_BASELINE)
+    df_station_info = load_excel_file_cached(
+        FILE_PATH_STATION_INFO, columns=["stop_id", "station", "lat", "lon"]
+    )
+    df_baseline_footfall = load_excel_file_cached(
+        FILE_PATH_STATION_FOOTFALL_BASELINE, columns=["stop_id", "footfall_baseline"]
+    )
 
     if df_station_info.empty:
         print("Exiting due to failure to load station info data.")
@@ -482,18 +708,26 @@ if __name__ == "__main__":
         print("Exiting due as no footfall baseline data was loaded.")
         exit(1)
 
-    # Ensure stop_id is string in info for merging later
-    df_station_info["stop_id"] = df_station_info["stop_id"].astype(str)
-    df_baseline_footfall["stop_id"] = df_baseline_footfall["stop_id"].astype(str)
+    # Enforce stop_id as an (Arrow-backed) string once at load, so get_Live_Crowding
+    # needs no per-row str() conversions
+    df_baseline_footfall["stop_id"] = df_baseline_footfall["stop_id"].astype(
+        "string[pyarrow]"
+    )
     df_baseline_footfall["footfall_baseline"] = pd.to_numeric(
         df_baseline_footfall["footfall_baseline"], errors="coerce"
     ).fillna(0)
 
+    # Maximum baseline stored in the Parquet metadata (None if the copy was written
+    # without it, e.g. by Make_Dashboard_html; it is then computed on the fly)
+    max_baseline_footfall = df_baseline_footfall.attrs.get("max_footfall_baseline")
+
     # Prepare for get_Live_Crowding: Pass only stop_id and footfall_baseline
     df_stations_for_api = df_baseline_footfall[["stop_id", "footfall_baseline"]].copy()
 
     # --- Fetch Current Live Crowding Data ---
-    df_current_live_data = get_Live_Crowding(TFL_STOPPOINT_URL, df_stations_for_api)
+    df_current_live_data = asyncio.run(
+        get_Live_Crowding(TFL_STOPPOINT_URL, df_stations_for_api, max_baseline_footfall)
+    )
 
     if df_current_live_data.empty:
         print(
@@ -501,32 +735,45 @@ if __name__ == "__main__":
         )
         exit(0)  # Exit gracefully if no data
 
-    # --- Save Current Data (now containing crowding_metric) to Google Sheets ---
-    save_dataframe_to_google_sheet(
-        df_current_live_data,
-        GOOGLE_SHEET_ID,
-        GOOGLE_WORKSHEET_NAME,
-        GOOGLE_SERVICE_ACCOUNT_KEY_PATH,
-    )
+    # --- Load ALL historical data from the local history for JSON generation ---
+    df_historical_data = load_parquet_file(FILE_PATH_LIVE_CROWDING_HISTORY)
+    history_path = FILE_PATH_LIVE_CROWDING_HISTORY
+    if df_historical_data.empty:
+        # First run: seed the local history from Google Sheets (once)
+        df_historical_data = load_historical_data_from_google_sheet(
+            GOOGLE_SHEET_ID,
+            GOOGLE_WORKSHEET_NAME,
+            GOOGLE_SERVICE_ACCOUNT_KEY_PATH,
+        )
+        if df_historical_data is None:
+            # Don't persist a history without the sheet's rows, so the next run seeds again
+            print(
+                "Could not seed the local history from Google Sheets. "
+                "It will not be saved this run."
+            )
+            df_historical_data = pd.DataFrame()
+            history_path = None
 
-    # --- Load ALL historical data from Google Sheets for JSON generation ---
-    df_historical_data = load_historical_data_from_google_sheet(
-        GOOGLE_SHEET_ID,
-        GOOGLE_WORKSHEET_NAME,
-        GOOGLE_SERVICE_ACCOUNT_KEY_PATH,
+    # --- Add Current Data (now containing crowding_metric) to the local history ---
+    df_historical_data = append_to_local_history(
+        df_historical_data, df_current_live_data, history_path
     )
 
-    if df_historical_data.empty:
-        print(
-            "No historical data found in Google Sheet to generate JSON from. Exiting."
+    # --- Mirror Current Data to Google Sheets while the JSON is generated ---
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(
+            save_dataframe_to_google_sheet,
+            df_current_live_data,
+            GOOGLE_SHEET_ID,
+            GOOGLE_WORKSHEET_NAME,
+            GOOGLE_SERVICE_ACCOUNT_KEY_PATH,
         )
-        exit(1)
 
-    # --- Generate JSON for HTML heatmap ---
-    generate_heatmap_json(
-        df_historical_data,
-        df_station_info,
-        OUTPUT_HTML_JSON_FILE,
-    )
+        # --- Generate JSON for HTML heatmap ---
+        generate_heatmap_json(
+            df_historical_data,
+            df_station_info,
+            OUTPUT_HTML_JSON_FILE,
+        )
 
     print("\n--- Script Execution Finished ---")
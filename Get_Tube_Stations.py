@@ -1,4 +1,6 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 import time
 import json
 import pandas as pd  # Import pandas for DataFrame operations
@@ -7,6 +9,20 @@ import pandas as pd  # Import pandas for DataFrame operations
 TFL_STOPPOINT_URL = "https://api.tfl.gov.uk/StopPoint/Mode/tube"
 # TFL_STOPPOINT_URL_EL = "https://api.tfl.gov.uk/StopPoint/Mode/elizabeth-line"
 STATION_MAP_FILENAME = "data/station_info.xlsx"  # File path to save data files
+# Parquet copy of the station info, read by Get_Live_Crowding
+STATION_MAP_PARQUET_FILENAME = "data/station_info.parquet"
+
+# Shared HTTP session: pooled keep-alive connections and automatic retries on
+# transient errors (as in Calculate_Baseline_Footfall)
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        max_retries=Retry(
+            total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]
+        )
+    ),
+)
 
 
 def query_TFL(
@@ -16,7 +32,7 @@ def query_TFL(
     _session: requests.Session = None,
 ) -> list:
     """Queries the TfL API with retry logic."""
-    session_to_use = _session if _session else requests.Session()
+    session_to_use = _session if _session else SESSION
     for retry_attempt in range(max_retries):
         try:
             response = session_to_use.get(url, params=params, timeout=10)
@@ -104,4 +120,15 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"Error saving stop points DataFrame to Excel: {e}")
 
+    # Save DataFrame to Parquet file (stop_id kept as a string column)
+    try:
+        df_stop_points.astype({"stop_id": str}).to_parquet(
+            STATION_MAP_PARQUET_FILENAME, index=False
+        )
+        print(
+            f"Stop points DataFrame successfully saved to '{STATION_MAP_PARQUET_FILENAME}'"
+        )
+    except Exception as e:
+        print(f"Error saving stop points DataFrame to Parquet: {e}")
+
     print("\nProcess finished.")
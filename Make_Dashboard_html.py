@@ -1,6 +1,12 @@
+import argparse
 import pandas as pd
-import json
+import numpy as np
+import orjson
 import os
+import gzip
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Configuration ---
 # Ensure these file names match your actual CSV files in the same directory
@@ -8,151 +14,17 @@ STATION_INFO_FILE = "data/station_info.xlsx"
 BASELINE_FOOTFALL_FILE = "data/stations_baseline_footfall.xlsx"
 LIVE_CROWDING_FILE = "data/stations_live_crowding.xlsx"
 OUTPUT_HTML_FILE = "index.html"  # The name of the generated HTML file
+OUTPUT_HTML_GZ_FILE = OUTPUT_HTML_FILE + ".gz"  # Pre-compressed copy for static hosting
+BUILD_HASH_FILE = OUTPUT_HTML_FILE + ".buildhash"  # Digest of the last build's inputs
+HEATMAP_MAX_INTENSITY = 50  # Crowding metric (%) drawn at full heatmap intensity
+COORDINATE_DECIMALS = 5  # Embedded lat/lon precision (~1 m)
+CROWDING_METRIC_DECIMALS = 2  # Embedded crowding metric precision (in %)
 
 
-def generate_heatmap_dashboard():
-    """
-    Loads station data from CSVs, processes it, and generates a
-    self-contained HTML heatmap dashboard with the data embedded.
-    """
-    print("Starting data processing and HTML generation...")
-
-    # --- 1. Data Loading and Processing ---
-    # Check if files exist
-    for f_name in [STATION_INFO_FILE, BASELINE_FOOTFALL_FILE, LIVE_CROWDING_FILE]:
-        if not os.path.exists(f_name):
-            print(f"Error: File not found: {f_name}.")
-            print(
-                "Please ensure all Excel files are in the correct 'data/' subdirectory relative to this script."
-            )
-            return
-
-    try:
-        station_info_df = pd.read_excel(STATION_INFO_FILE)
-        baseline_footfall_df = pd.read_excel(BASELINE_FOOTFALL_FILE)
-        live_crowding_df = pd.read_excel(LIVE_CROWDING_FILE)
-        print("Excel files loaded successfully.")
-
-        # Convert timestamp to datetime objects
-        live_crowding_df["timestamp"] = pd.to_datetime(live_crowding_df["timestamp"])
-
-        # Calculate max_baseline_footfall once for consistent normalization
-        max_baseline_footfall = baseline_footfall_df["footfall_baseline"].max()
-        print(f"Maximum baseline footfall: {max_baseline_footfall}")
-
-        # Dictionary to store data for each resolution (hourly, daily, weekly)
-        processed_all_data = {}
-
-        # --- Helper function for data processing (refactored) ---
-        def _process_data_for_resolution(
-            live_df_segment, station_info, max_baseline, resolution_type
-        ):
-            """
-            Processes a segment of live footfall data for a given resolution.
-            Handles merging, crowding metric calculation, and data cleaning.
-            """
-            processed_data_for_resolution = {}
-
-            if resolution_type == "hourly":
-                # For hourly, we process each unique timestamp as is
-                unique_time_units = sorted(live_df_segment["timestamp"].unique())
-                group_by_cols = None
-            elif resolution_type == "daily":
-                # For daily, group by date and calculate average footfall
-                live_df_segment["date"] = live_df_segment["timestamp"].dt.date
-                daily_avg_footfall = (
-                    live_df_segment.groupby(["stop_id", "date"])["live_footfall"]
-                    .mean()
-                    .reset_index()
-                )
-                live_df_segment = (
-                    daily_avg_footfall  # Use this aggregated DataFrame for merging
-                )
-                unique_time_units = sorted(live_df_segment["date"].unique())
-                group_by_cols = "date"
-            elif resolution_type == "weekly":
-                # For weekly, group by week start and calculate average footfall
-                live_df_segment["week_start"] = (
-                    live_df_segment["timestamp"]
-                    .dt.to_period("W")
-                    .apply(lambda r: r.start_time)
-                )
-                weekly_avg_footfall = (
-                    live_df_segment.groupby(["stop_id", "week_start"])["live_footfall"]
-                    .mean()
-                    .reset_index()
-                )
-                live_df_segment = (
-                    weekly_avg_footfall  # Use this aggregated DataFrame for merging
-                )
-                unique_time_units = sorted(live_df_segment["week_start"].unique())
-                group_by_cols = "week_start"
-            else:
-                raise ValueError(f"Unknown resolution type: {resolution_type}")
-
-            for time_unit in unique_time_units:
-                if group_by_cols:
-                    current_df = live_df_segment[
-                        live_df_segment[group_by_cols] == time_unit
-                    ]
-                else:  # This applies to hourly where live_df_segment is already filtered by the loop
-                    current_df = live_df_segment[
-                        live_df_segment["timestamp"] == time_unit
-                    ]
-
-                merged_df = pd.merge(station_info, current_df, on="stop_id", how="left")
-                merged_df["lat"] = pd.to_numeric(merged_df["lat"], errors="coerce")
-                merged_df["lon"] = pd.to_numeric(merged_df["lon"], errors="coerce")
-
-                if max_baseline == 0:
-                    merged_df["crowding_metric"] = 0
-                else:
-                    merged_df["crowding_metric"] = (
-                        merged_df["live_footfall"] / max_baseline
-                    ) * 100
-
-                merged_df["crowding_metric"] = (
-                    merged_df["crowding_metric"]
-                    .replace([float("inf"), -float("inf")], pd.NA)
-                    .fillna(0)
-                )
-
-                heatmap_data_for_unit = (
-                    merged_df[["lat", "lon", "crowding_metric", "station"]]
-                    .dropna()
-                    .values.tolist()
-                )
-                processed_data_for_resolution[str(time_unit)] = heatmap_data_for_unit
-            return processed_data_for_resolution
-
-        # Process data for each resolution using the helper function
-        processed_all_data["hourly"] = _process_data_for_resolution(
-            live_crowding_df.copy(), station_info_df, max_baseline_footfall, "hourly"
-        )
-        print(
-            f"Hourly data processed for {len(processed_all_data['hourly'])} timestamps."
-        )
-
-        processed_all_data["daily"] = _process_data_for_resolution(
-            live_crowding_df.copy(), station_info_df, max_baseline_footfall, "daily"
-        )
-        print(f"Daily data processed for {len(processed_all_data['daily'])} dates.")
-
-        processed_all_data["weekly"] = _process_data_for_resolution(
-            live_crowding_df.copy(), station_info_df, max_baseline_footfall, "weekly"
-        )
-        print(f"Weekly data processed for {len(processed_all_data['weekly'])} weeks.")
-
-        processed_data_json = json.dumps(processed_all_data, indent=2)
-        print(f"Total processed data size: {len(processed_data_json)} characters.")
-
-    except Exception as e:
-        print(f"An error occurred during data processing: {e}")
-        print("Generating HTML with empty data array.")
-        processed_data_json = "{}"  # Fallback to empty object if data processing fails
-
-    # --- 2. HTML Template ---
-    html_template = f"""
+# --- HTML Template ---
+# Built once at import, and split around the embedded data, so the (large) JSON is written
+# straight to the file instead of being copied into one combined document string
+HTML_TEMPLATE_HEAD = """
 <!DOCTYPE html>
 <html lang="en">
 <head>
@@ -169,42 +41,42 @@ def generate_heatmap_dashboard():
     <link href="https://fonts.googleapis.com/css2?family=PT+Sans+Narrow:wght@400;700&display=swap" rel="stylesheet">
 
     <style>
-        :root {{
+        :root {
             --button-size: 22px;
             --button-font-size: 0.7em;
             --playback-icon-play-font-size: 0.9em; /* Adjusted for play icon */
             --playback-icon-pause-font-size: 1.2em; /* Keep for pause icon */
-        }}
+        }
 
         /* Custom CSS for map container to ensure it takes full height */
-        #map {{
+        #map {
             height: 80vh; /* Set a responsive height for the map */
             width: 100%;
             border-radius: 0.5rem; /* Apply rounded corners */
             box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1); /* Add a subtle shadow */
-        }}
-        body {{
+        }
+        body {
             font-family: 'Inter', sans-serif; /* Use Inter font */
-        }}
+        }
         /* Styles for the custom legend */
-        .info.legend {{
+        .info.legend {
             background: white;
             padding: 10px;
             border-radius: 5px;
             box-shadow: 0 0 15px rgba(0,0,0,0.2);
             line-height: 1.5em;
             font-size: 0.9em; /* Smaller font for legend */
-        }}
-        .info.legend i {{
+        }
+        .info.legend i {
             width: 18px;
             height: 12px;
             float: left;
             margin-right: 8px;
             opacity: 0.8;
             border-radius: 2px;
-        }}
+        }
         /* Styles for the combined controls box (Leaflet Control) */
-        .leaflet-control.combined-controls-container {{
+        .leaflet-control.combined-controls-container {
             background: white;
             padding: 5px; /* Reduced padding for less height */
             border-radius: 5px;
@@ -212,23 +84,23 @@ def generate_heatmap_dashboard():
             text-align: center;
             width: 300px; /* Fixed width for slider */
             /* Removed margin-bottom, margin-left, margin-right as it's now a Leaflet control */
-        }}
-        .combined-controls-container .resolution-group {{
+        }
+        .combined-controls-container .resolution-group {
             margin-bottom: 5px; /* Reduced margin */
             font-size: 1em; /* Increased font size for hourly/daily/weekly labels */
-        }}
-        .combined-controls-container .time-slider-group {{
+        }
+        .combined-controls-container .time-slider-group {
             display: flex;
             align-items: center;
             justify-content: center;
             margin-bottom: 5px; /* Reduced margin */
-        }}
-        .combined-controls-container input[type="range"] {{
+        }
+        .combined-controls-container input[type="range"] {
             flex-grow: 1;
             margin: 0 5px;
-        }}
+        }
         /* Play/Pause button styling - Adjusted size to match scroll buttons using CSS variables */
-        .combined-controls-container .play-pause-button {{
+        .combined-controls-container .play-pause-button {
             background-color: #4CAF50; /* Green */
             border: none;
             color: white;
@@ -245,21 +117,21 @@ def generate_heatmap_dashboard():
             align-items: center;
             justify-content: center;
             line-height: 1;
-        }}
+        }
         /* Specific font sizes for play and pause icons */
-        .combined-controls-container .play-pause-button::before {{ /* pseudo-element for icon font-size */
+        .combined-controls-container .play-pause-button::before { /* pseudo-element for icon font-size */
             font-size: var(--playback-icon-play-font-size);
-        }}
-        .combined-controls-container .play-pause-button.playing::before {{ /* pseudo-element for icon font-size when playing */
+        }
+        .combined-controls-container .play-pause-button.playing::before { /* pseudo-element for icon font-size when playing */
             font-size: var(--playback-icon-pause-font-size);
-        }}
+        }
 
 
-        .combined-controls-container .play-pause-button:hover {{
+        .combined-controls-container .play-pause-button:hover {
             background-color: #45a049;
-        }}
+        }
         /* Smaller scroll buttons using CSS variables */
-        .scroll-button {{
+        .scroll-button {
             background-color: #007bff; /* Blue */
             color: white;
             border: none;
@@ -274,12 +146,12 @@ def generate_heatmap_dashboard():
             align-items: center;
             justify-content: center;
             line-height: 1;
-        }}
-        .scroll-button:hover {{
+        }
+        .scroll-button:hover {
             background-color: #0056b3;
-        }}
+        }
         /* Style for the new bottom-left timestamp control - Increased size, transparent white background, new font */
-        .timestamp-display-control {{
+        .timestamp-display-control {
             font-size: 3.5em; /* Increased Larger font */
             color: #AAAAAA; /* Even lighter Grey lettering */
             font-family: 'PT Sans Narrow', sans-serif; /* New narrow font */
@@ -291,16 +163,16 @@ def generate_heatmap_dashboard():
             bottom: 0px !important; /* Moved to very bottom */
             left: 0px !important; /* Moved to very left */
             line-height: 1; /* Adjust line height for closer packing */
-        }}
+        }
         /* Radio button styling */
-        .resolution-group label {{
+        .resolution-group label {
             margin-right: 10px;
             font-size: 1em; /* Ensures text size is consistent with the new font-size for resolution-group */
-        }}
-        .resolution-group input[type="radio"] {{
+        }
+        .resolution-group input[type="radio"] {
             transform: scale(1.0); /* Smaller radio buttons */
             margin-right: 3px; /* Reduced margin */
-        }}
+        }
     </style>
 </head>
 <body class="bg-gray-100 p-4 sm:p-6 lg:p-8">
@@ -321,15 +193,21 @@ def generate_heatmap_dashboard():
         </div>
     </div>
 
+    <script id="heatmap-data" type="application/json">"""
+HTML_TEMPLATE_TAIL = f"""</script>
+
     <script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"
         integrity="sha256-20nQCchB9co0qIjJZRGuk2/Z9VM+kNiyxNV1lvTlZBo="
         crossorigin=""></script>
     <script src="https://unpkg.com/leaflet.heat@0.2.0/dist/leaflet-heat.js"></script>
 
     <script>
-        // Embed the processed station data directly into the HTML
-        const allProcessedData = JSON.parse(`{processed_data_json}`);
+        // The processed station data is embedded above as a JSON block (parsed once, without the JS parser)
+        const allProcessedData = JSON.parse(document.getElementById('heatmap-data').textContent);
         console.log("All processed data by resolution:", allProcessedData);
+        // Unique station names, and the index into them for each row of a time unit's points
+        const stationNameTable = allProcessedData.names;
+        const stationNameIdx = allProcessedData.name_idx;
 
         // Global variables for current resolution and its timestamps
         let currentResolution = 'hourly'; // Default resolution
@@ -349,7 +227,8 @@ def generate_heatmap_dashboard():
 
         let map;
         let heatmapLayer;
-        let currentStationMarkers = [];
+        let stationMarkersLayer; // Layer group holding the (invisible) popup markers
+        let stationMarkersRenderer;
 
         let animationInterval;
         let isPlaying = false;
@@ -428,23 +307,12 @@ def generate_heatmap_dashboard():
             const currentStationData = allProcessedData[currentResolution][selectedTimestampStr];
 
             if (heatmapLayer) {{ map.removeLayer(heatmapLayer); }}
-            currentStationMarkers.forEach(marker => map.removeLayer(marker));
-            currentStationMarkers = [];
-
-            const cleanStationData = currentStationData.filter(entry =>
-                Array.isArray(entry) && entry.length >= 4 &&
-                typeof entry[0] === 'number' && !isNaN(entry[0]) &&
-                typeof entry[1] === 'number' && !isNaN(entry[1])
-            );
-
-            const heatData = cleanStationData.map(station => {{
-                const lat = station[0]; const lon = station[1];
-                let crowdingMetric = station[2];
-                if (typeof crowdingMetric !== 'number' || isNaN(crowdingMetric)) {{ crowdingMetric = 0; }}
-                return [lat, lon, crowdingMetric];
-            }});
+            stationMarkersLayer.clearLayers();
+
+            // Points are already [lat, lon, metric] rows with finite coordinates (built in Python)
+            const heatData = currentStationData.points;
 
-            const heatMax = 50; // Set heatMax to a fixed value of 50 (for 50%)
+            const heatMax = {HEATMAP_MAX_INTENSITY}; // Fixed maximum, set in Python (in %)
 
             heatmapLayer = L.heatLayer(heatData, {{
                 radius: 8, blur: 4, maxZoom: 0, max: heatMax,
@@ -454,17 +322,16 @@ def generate_heatmap_dashboard():
                 }}
             }}).addTo(map);
 
-            cleanStationData.forEach(station => {{
-                const lat = station[0]; const lon = station[1];
-                const crowdingMetric = station[2]; const stationName = station[3];
-                const marker = L.circleMarker([lat, lon], {{
+            heatData.forEach((point, i) => {{
+                const lat = point[0]; const lon = point[1];
+                const crowdingMetric = point[2]; const stationName = stationNameTable[stationNameIdx[i]];
+                L.circleMarker([lat, lon], {{
+                    renderer: stationMarkersRenderer,
                     radius: 8, fillOpacity: 0, stroke: false, interactive: true
                 }})
                 // Display crowding metric as an integer percentage in the popup
-                .bindPopup(`<b>Station:</b> ${{stationName}}<br><b>Crowding Metric:</b> ${{Math.round(crowdingMetric)}}%`);
-                marker.addTo(map);
-                marker.bringToFront();
-                currentStationMarkers.push(marker);
+                .bindPopup(`<b>Station:</b> ${{stationName}}<br><b>Crowding Metric:</b> ${{Math.round(crowdingMetric)}}%`)
+                .addTo(stationMarkersLayer);
             }});
         }}
 
@@ -530,6 +397,13 @@ def generate_heatmap_dashboard():
             map.createPane('tubeLinesPane');
             map.getPane('tubeLinesPane').style.zIndex = 350;
 
+            // Draw all station markers on one shared canvas (instead of one SVG element each),
+            // in a pane above the heatmap so they still receive clicks
+            map.createPane('stationMarkersPane');
+            map.getPane('stationMarkersPane').style.zIndex = 450;
+            stationMarkersRenderer = L.canvas({{ pane: 'stationMarkersPane', padding: 0.5 }});
+            stationMarkersLayer = L.layerGroup().addTo(map);
+
             fetch(tubeLinesGeoJSONUrl)
                 .then(response => {{
                     if (!response.ok) {{ throw new Error(`HTTP error! status: ${{response.status}}`); }}
@@ -629,19 +503,333 @@ def generate_heatmap_dashboard():
     </script>
 </body>
 </html>
+"""
+
+
+def _load_cached(path_xlsx, columns=None):
     """
+    Loads (selected columns of) an Excel file through its Parquet copy (same name, .parquet).
+    The Parquet copy is only (re)written from the Excel file when it is missing or older.
+    Returns an empty DataFrame if the file can't be loaded.
+    """
+    path_parquet = os.path.splitext(path_xlsx)[0] + ".parquet"
+    if not os.path.exists(path_parquet) or os.path.getmtime(
+        path_parquet
+    ) < os.path.getmtime(path_xlsx):
+        try:
+            print(f"Caching '{path_xlsx}' as '{path_parquet}'...")
+            df_excel = pd.read_excel(path_xlsx, engine="calamine")
+            if "stop_id" in df_excel.columns:
+                df_excel["stop_id"] = df_excel["stop_id"].astype(str)
+            df_excel.to_parquet(path_parquet, index=False)
+        except Exception as e:
+            print(f"Error caching '{path_xlsx}' as Parquet: {e}")
+            return pd.DataFrame()
+
+    try:
+        return pd.read_parquet(path_parquet, engine="pyarrow", columns=columns)
+    except Exception as e:
+        print(f"Error loading data from '{path_parquet}': {e}")
+        return pd.DataFrame()
+
+
+def _build_hash():
+    """
+    Returns a digest of the input files (path, mtime and size) and of this script itself,
+    so a change to either the data or the template triggers a rebuild.
+    """
+    key = hashlib.blake2b(digest_size=16)
+    for path in (
+        STATION_INFO_FILE,
+        BASELINE_FOOTFALL_FILE,
+        LIVE_CROWDING_FILE,
+        __file__,
+    ):
+        st = os.stat(path)
+        key.update(path.encode())
+        key.update(st.st_mtime_ns.to_bytes(8, "little"))
+        key.update(st.st_size.to_bytes(8, "little"))
+    return key.hexdigest()
+
+
+def generate_heatmap_dashboard(force=False):
+    """
+    Loads station data from CSVs, processes it, and generates a
+    self-contained HTML heatmap dashboard with the data embedded.
+    Unless force is set, nothing is rebuilt when the inputs have not changed.
+    """
+    print("Starting data processing and HTML generation...")
+
+    # --- 1. Data Loading and Processing ---
+    # Check if files exist
+    for f_name in [STATION_INFO_FILE, BASELINE_FOOTFALL_FILE, LIVE_CROWDING_FILE]:
+        if not os.path.exists(f_name):
+            print(f"Error: File not found: {f_name}.")
+            print(
+                "Please ensure all Excel files are in the correct 'data/' subdirectory relative to this script."
+            )
+            return
+
+    # Skip the build if the page was already generated from these exact inputs
+    build_hash = _build_hash()
+    if (
+        not force
+        and os.path.exists(OUTPUT_HTML_FILE)
+        and os.path.exists(BUILD_HASH_FILE)
+    ):
+        with open(BUILD_HASH_FILE) as f:
+            if f.read().strip() == build_hash:
+                print(
+                    f"Inputs unchanged since '{OUTPUT_HTML_FILE}' was built. Skipping (use --force to rebuild)."
+                )
+                return
+
+    try:
+        # Load the three files concurrently (the parsing/decoding largely releases the GIL)
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            f_info, f_base, f_live = [
+                executor.submit(_load_cached, path, columns)
+                for path, columns in (
+                    (STATION_INFO_FILE, ["stop_id", "station", "lat", "lon"]),
+                    (BASELINE_FOOTFALL_FILE, ["footfall_baseline"]),
+                    (LIVE_CROWDING_FILE, ["stop_id", "timestamp", "live_footfall"]),
+                )
+            ]
+            station_info_df = f_info.result()
+            baseline_footfall_df = f_base.result()
+            live_crowding_df = f_live.result()
+        if (
+            station_info_df.empty
+            or baseline_footfall_df.empty
+            or live_crowding_df.empty
+        ):
+            raise ValueError("One or more input files could not be loaded.")
+        print("Excel files loaded successfully.")
+
+        # Convert timestamp to datetime objects
+        live_crowding_df["timestamp"] = pd.to_datetime(live_crowding_df["timestamp"])
+
+        # Coerce the numeric columns once, as float32 (enough for ~1 m coordinates and
+        # footfall counts), instead of re-converting lat/lon after every merge below
+        for col in ["lat", "lon"]:
+            station_info_df[col] = pd.to_numeric(
+                station_info_df[col], errors="coerce", downcast="float"
+            )
+        live_crowding_df["live_footfall"] = pd.to_numeric(
+            live_crowding_df["live_footfall"], errors="coerce", downcast="float"
+        )
+
+        # Give stop_id one shared categorical dtype in the station info and live data,
+        # so the lookups and groupbys below match integer codes instead of strings
+        stop_id_dtype = pd.api.types.union_categoricals(
+            [
+                pd.Categorical(station_info_df["stop_id"]),
+                pd.Categorical(live_crowding_df["stop_id"]),
+            ]
+        ).dtype
+        station_info_df["stop_id"] = station_info_df["stop_id"].astype(stop_id_dtype)
+        live_crowding_df["stop_id"] = live_crowding_df["stop_id"].astype(stop_id_dtype)
+
+        # Calculate max_baseline_footfall once for consistent normalization
+        max_baseline_footfall = baseline_footfall_df["footfall_baseline"].max()
+        print(f"Maximum baseline footfall: {max_baseline_footfall}")
+
+        # The station side is the same for every resolution and time unit, so take its
+        # arrays (and drop stations without coordinates or a name) once, up front
+        station_lat = station_info_df["lat"].to_numpy()
+        station_lon = station_info_df["lon"].to_numpy()
+        station_names = station_info_df["station"].to_numpy()
+        station_mask = (
+            np.isfinite(station_lat)
+            & np.isfinite(station_lon)
+            & pd.notna(station_names)
+        )
+        # Round off digits the map cannot show, to shrink the embedded JSON
+        station_lat = station_lat[station_mask].astype(float).round(COORDINATE_DECIMALS)
+        station_lon = station_lon[station_mask].astype(float).round(COORDINATE_DECIMALS)
+        # Station names are embedded once, as a table of unique names plus an index per
+        # station row; the rows of every time unit's points follow the same station order
+        station_name_table, station_name_idx = np.unique(
+            station_names[station_mask], return_inverse=True
+        )
+        station_codes = station_info_df["stop_id"].cat.codes.to_numpy()[station_mask]
+
+        # Dictionary to store data for each resolution (hourly, daily, weekly)
+        processed_all_data = {}
+        processed_all_data["names"] = station_name_table.tolist()
+        processed_all_data["name_idx"] = station_name_idx
+
+        # --- Helper function for data processing (refactored) ---
+        def _process_data_for_resolution(
+            live_df_segment, max_baseline, resolution_type
+        ):
+            """
+            Processes a segment of live footfall data for a given resolution.
+            Handles the station lookup, crowding metric calculation, and data cleaning.
+            """
+            processed_data_for_resolution = {}
+
+            if resolution_type == "hourly":
+                # For hourly, we process each unique timestamp as is
+                group_by_cols = "timestamp"
+            elif resolution_type == "daily":
+                # For daily, group by date and calculate average footfall
+                live_df_segment["date"] = live_df_segment["timestamp"].dt.date
+                daily_avg_footfall = (
+                    live_df_segment.groupby(["stop_id", "date"], observed=True)[
+                        "live_footfall"
+                    ]
+                    .mean()
+                    .reset_index()
+                )
+                live_df_segment = (
+                    daily_avg_footfall  # Use this aggregated DataFrame for merging
+                )
+                group_by_cols = "date"
+            elif resolution_type == "weekly":
+                # For weekly, group by week start and calculate average footfall
+                live_df_segment["week_start"] = (
+                    live_df_segment["timestamp"]
+                    .dt.to_period("W")
+                    .apply(lambda r: r.start_time)
+                )
+                weekly_avg_footfall = (
+                    live_df_segment.groupby(["stop_id", "week_start"], observed=True)[
+                        "live_footfall"
+                    ]
+                    .mean()
+                    .reset_index()
+                )
+                live_df_segment = (
+                    weekly_avg_footfall  # Use this aggregated DataFrame for merging
+                )
+                group_by_cols = "week_start"
+            else:
+                raise ValueError(f"Unknown resolution type: {resolution_type}")
+
+            # Find the rows of every (sorted) time unit in one O(N) pass,
+            # instead of scanning the whole segment with a boolean mask per time unit
+            time_unit_codes, unique_time_units = pd.factorize(
+                live_df_segment[group_by_cols], sort=True
+            )
+            has_time_unit = time_unit_codes >= 0  # Skip missing timestamps
+            row_order = np.flatnonzero(has_time_unit)[
+                np.argsort(time_unit_codes[has_time_unit], kind="stable")
+            ]
+            rows_per_time_unit = np.bincount(
+                time_unit_codes[has_time_unit], minlength=len(unique_time_units)
+            )
+            time_unit_rows = np.split(row_order, np.cumsum(rows_per_time_unit)[:-1])
 
-    # --- 3. Save the HTML file ---
+            # Join on the shared stop_id category codes through a lookup array (one slot
+            # per stop_id, plus a last one for missing ids) instead of a merge per time unit
+            live_codes = live_df_segment["stop_id"].cat.codes.to_numpy()
+            live_footfall = live_df_segment["live_footfall"].to_numpy(dtype=float)
+            footfall_by_stop = np.empty(len(stop_id_dtype.categories) + 1)
+
+            for time_unit, rows in zip(unique_time_units, time_unit_rows):
+                footfall_by_stop.fill(np.nan)
+                footfall_by_stop[live_codes[rows]] = live_footfall[rows]
+                crowding_metric = footfall_by_stop[station_codes]
+
+                if max_baseline == 0:
+                    crowding_metric[:] = 0
+                else:
+                    # Compute the metric and replace NaN/inf with 0 in place on one array
+                    crowding_metric /= max_baseline
+                    crowding_metric *= 100
+                    np.nan_to_num(
+                        crowding_metric, copy=False, nan=0.0, posinf=0.0, neginf=0.0
+                    )
+
+                # Ship the numeric [lat, lon, metric] rows as one array (used directly
+                # as the heatmap data); row i is named by names[name_idx[i]]
+                points = np.column_stack(
+                    (
+                        station_lat,
+                        station_lon,
+                        crowding_metric.round(CROWDING_METRIC_DECIMALS),
+                    )
+                )
+                heatmap_data_for_unit = {"points": points}
+                processed_data_for_resolution[str(time_unit)] = heatmap_data_for_unit
+            return processed_data_for_resolution
+
+        # Process data for each resolution using the helper function
+        processed_all_data["hourly"] = _process_data_for_resolution(
+            live_crowding_df.copy(), max_baseline_footfall, "hourly"
+        )
+        print(
+            f"Hourly data processed for {len(processed_all_data['hourly'])} timestamps."
+        )
+
+        processed_all_data["daily"] = _process_data_for_resolution(
+            live_crowding_df.copy(), max_baseline_footfall, "daily"
+        )
+        print(f"Daily data processed for {len(processed_all_data['daily'])} dates.")
+
+        processed_all_data["weekly"] = _process_data_for_resolution(
+            live_crowding_df.copy(), max_baseline_footfall, "weekly"
+        )
+        print(f"Weekly data processed for {len(processed_all_data['weekly'])} weeks.")
+
+        # orjson writes the compact JSON (no indentation) straight to UTF-8 bytes,
+        # and handles NumPy scalars left in the rows without converting them first
+        processed_data_json = orjson.dumps(
+            processed_all_data, option=orjson.OPT_SERIALIZE_NUMPY
+        ).decode()
+        # Escape "</" so nothing in the data can close the embedding <script> block early
+        processed_data_json = processed_data_json.replace("</", "<\\/")
+        print(f"Total processed data size: {len(processed_data_json)} characters.")
+
+    except Exception as e:
+        print(f"An error occurred during data processing: {e}")
+        print("Generating HTML with empty data array.")
+        processed_data_json = "{}"  # Fallback to empty object if data processing fails
+        build_hash = None  # Don't record a build with empty data as up to date
+
+    # --- 2. Save the HTML file ---
     try:
-        with open(OUTPUT_HTML_FILE, "w") as f:
-            f.write(html_template)
+        # Forget the previous build first, so a failed (or empty) build is never
+        # mistaken for an up-to-date one on the next run
+        if os.path.exists(BUILD_HASH_FILE):
+            os.remove(BUILD_HASH_FILE)
+        with open(OUTPUT_HTML_FILE, "w", buffering=1 << 20) as f:
+            f.write(HTML_TEMPLATE_HEAD)
+            f.write(processed_data_json)
+            f.write(HTML_TEMPLATE_TAIL)
+        if build_hash:
+            with open(BUILD_HASH_FILE, "w") as f:
+                f.write(build_hash)
         print(f"\nSuccessfully generated '{OUTPUT_HTML_FILE}'!")
         print(
             f"You can now open '{OUTPUT_HTML_FILE}' in your web browser or host it on GitHub Pages."
         )
     except Exception as e:
         print(f"Error saving HTML file: {e}")
+        return  # Don't compress a missing or partially written page
+
+    # --- 3. Save a gzip-compressed copy (mtime=0 keeps rebuilds of the same page identical) ---
+    try:
+        with open(OUTPUT_HTML_FILE, "rb") as src, gzip.GzipFile(
+            OUTPUT_HTML_GZ_FILE, "wb", compresslevel=9, mtime=0
+        ) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        print(
+            f"Compressed copy saved to '{OUTPUT_HTML_GZ_FILE}' ({os.path.getsize(OUTPUT_HTML_GZ_FILE)} bytes)."
+        )
+    except Exception as e:
+        print(f"Error saving compressed HTML file: {e}")
 
 
 if __name__ == "__main__":
-    generate_heatmap_dashboard()
+    parser = argparse.ArgumentParser(
+        description="Generate the London tube station heatmap dashboard."
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="rebuild the dashboard even if its inputs have not changed",
+    )
+    args = parser.parse_args()
+    generate_heatmap_dashboard(force=args.force)